@@ -0,0 +1,49 @@
+"""
+convert_nsfw_model.py
+=====================
+
+One-off helper that converts the nsfw_detector Keras model into the
+FP16-quantized TFLite file loaded by ingest_memes.py.  Run it once on a
+machine with tensorflow and nsfw-detector installed and commit the result:
+
+```
+python convert_nsfw_model.py path/to/nsfw_mobilenet2.224x224.h5 nsfw.tflite
+```
+
+The ingestion workflow then only has to load the converted model, which is
+much faster than loading and running the full Keras model on every run.
+"""
+
+import os
+import sys
+
+import tensorflow as tf
+from nsfw_detector import predict
+
+
+def convert(keras_path: str, tflite_path: str) -> None:
+    """Converts the Keras NSFW model to an FP16-quantized TFLite file."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(predict.load_model(keras_path))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+    # Write to a temporary file first so a failed write never leaves a
+    # truncated model behind for the ingestion script to pick up.
+    tmp_path = f"{tflite_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, tflite_path)
+
+
+def main() -> None:
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: {sys.argv[0]} KERAS_MODEL [OUTPUT]", file=sys.stderr)
+        sys.exit(1)
+    keras_path = sys.argv[1]
+    tflite_path = sys.argv[2] if len(sys.argv) == 3 else 'nsfw.tflite'
+    convert(keras_path, tflite_path)
+    print(f"Wrote {tflite_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -24,18 +24,28 @@ accompanying workflow file.  See README.md for details.
 import os
 import sys
 import json
+import html
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Set, Tuple, Dict
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 from io import BytesIO
-import imagehash
 
 # Used for generating published_at timestamps on inserted memes
 import datetime
 
+# TensorFlow sizes its thread pools when it is first imported, so pin them
+# before nsfw_detector pulls it in.  The defaults oversubscribe the small
+# GitHub-hosted runners.
+NSFW_THREADS = os.cpu_count() or 2
+os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(NSFW_THREADS))
+os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+
 try:
     # nsfw_detector pulls in tensorflow; import lazily to avoid heavy
     # startup cost if the module is missing.  The GitHub Actions workflow
@@ -44,6 +54,15 @@ try:
 except ImportError:
     predict = None  # type: ignore
 
+try:
+    # TensorFlow Lite runs the quantized NSFW model; it ships with the
+    # tensorflow package that nsfw_detector depends on.
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(NSFW_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+except ImportError:
+    tf = None  # type: ignore
+
 try:
     # supabase-py client; if not installed the script will exit with
     # instructions.
@@ -53,6 +72,56 @@ except ImportError:
     Client = None  # type: ignore
 
 
+# Number of images downloaded concurrently.  Downloads are network bound so
+# a generous pool overlaps the per-request latency of the Reddit CDNs.
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Number of images decoded and hashed concurrently (CPU bound).
+PROCESS_WORKERS = os.cpu_count() or 2
+# Keys per meme_hash_cache query; image URLs are long and the filter goes
+# in the request URL.
+HASH_CACHE_QUERY_CHUNK = 50
+
+# Shared HTTP session so that connections (and TLS handshakes) are reused
+# across requests to the same host.  The pool is sized above the worker
+# count so threads never block waiting for a free connection.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+
+# Smallest preview dimension worth downloading instead of the full image;
+# must cover both the decode target below and the NSFW model input.
+PREVIEW_MIN_DIM = 256
+
+# Input size and output categories of the nsfw_detector MobileNet model.
+NSFW_IMAGE_DIM = 224
+NSFW_CATEGORIES = ['drawings', 'hentai', 'neutral', 'porn', 'sexy']
+# Columns summed to form the NSFW probability
+NSFW_EXPLICIT = [NSFW_CATEGORIES.index(c) for c in ('porn', 'hentai', 'sexy')]
+# Images per forward pass; around 16-32 is the sweet spot on CPU runners.
+NSFW_BATCH_SIZE = 16
+# FP16-quantized TFLite conversion of the Keras NSFW model, produced once
+# with convert_nsfw_model.py.  The Keras model itself is only used if no
+# TFLite file is present and NSFW_MODEL_PATH points at it.
+NSFW_TFLITE_PATH = os.getenv('NSFW_TFLITE_PATH', 'nsfw.tflite')
+NSFW_MODEL_PATH = os.getenv('NSFW_MODEL_PATH')
+
+# Bit counts of every 16-bit value, used when np.bitwise_count (NumPy 2.0+)
+# is not available.
+_POPCOUNT_16 = np.array([bin(i).count('1') for i in range(1 << 16)], dtype=np.uint8)
+
+# pHash works on a 32x32 grayscale image and keeps the 8x8 lowest
+# frequencies of its DCT.  These are the first 8 rows of the (unnormalized,
+# as in scipy's default) DCT-II matrix, so the transform is two small FP32
+# matrix products.
+PHASH_SIZE = 32
+PHASH_LOW = 8
+_k = np.arange(PHASH_LOW)[:, None]
+_n = np.arange(PHASH_SIZE)[None, :]
+_DCT_LOW = (2 * np.cos(np.pi * _k * (2 * _n + 1) / (2 * PHASH_SIZE))).astype(np.float32)
+
+
 def error(message: str) -> None:
     """Prints an error message and exits."""
     print(f"ERROR: {message}", file=sys.stderr)
@@ -77,56 +146,191 @@ class MemeCandidate:
     source_url: str
     author: Optional[str]
     score: int
+    # Smaller Reddit-generated preview used for hashing and NSFW detection;
+    # image_url keeps the original that is stored in the database.
+    preview_url: Optional[str] = None
     md5: str = field(init=False)
     phash: Optional[str] = field(init=False)
     nsfw_score: float = field(init=False)
     duplicate_of: Optional[str] = field(init=False)
 
-    def download_and_process(self, nsfw_model) -> bool:
+    def download(self, session: requests.Session) -> Optional[bytes]:
         """
-        Downloads the image, computes MD5 and perceptual hash, and runs
-        NSFW detection.  Returns True if the image should be kept, False if
-        it should be rejected due to NSFW content.
+        Downloads the image (its preview, if there is one) using the given
+        session and sets its MD5.  Returns the raw image bytes or None if the
+        download failed.
         """
+        url = self.preview_url or self.image_url
         try:
-            resp = requests.get(self.image_url, timeout=15)
-            resp.raise_for_status()
-            img_data = resp.content
+            # Hash the body as it streams in rather than in a second pass
+            # over the whole buffer; this also keeps hashing on the download
+            # threads.  MD5 is only an equality fingerprint here.
+            digest = hashlib.md5(usedforsecurity=False)
+            chunks = []
+            with session.get(url, timeout=15, stream=True) as resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    chunks.append(chunk)
+            self.md5 = digest.hexdigest()
+            return b''.join(chunks)
         except Exception as e:
-            print(f"Failed to download {self.image_url}: {e}")
-            return False
-        # Compute MD5
-        self.md5 = hashlib.md5(img_data).hexdigest()
-        # Compute pHash
+            print(f"Failed to download {url}: {e}")
+            return None
+
+    def apply_cached(self, md5: str, entry: Tuple[Optional[str], Optional[float]]) -> None:
+        """Sets the hashes from a meme_hash_cache entry instead of computing them."""
+        self.md5 = md5
+        self.phash = entry[0]
+        self.nsfw_score = entry[1] or 0.0
+
+    def process(self, img_data: bytes, nsfw: bool = True) -> Optional[np.ndarray]:
+        """
+        Computes the perceptual hash of the downloaded image.  If nsfw is
+        True, returns the image preprocessed for the NSFW model, otherwise (or
+        if it could not be decoded) returns None.  NSFW scores are assigned
+        afterwards by classify_nsfw so that all candidates share a single
+        batched forward pass.
+        """
+        # If NSFW model not available (or decoding fails) treat the image as safe
+        self.nsfw_score = 0.0
+        # Decode once and derive both the pHash and NSFW inputs from the same
+        # image.  draft() lets libjpeg decode JPEGs at a reduced DCT scale
+        # (still at least 256px), which is all either consumer needs.  The
+        # decode is the same whether or not the NSFW input is wanted, so the
+        # stored pHash does not depend on whether a model is loaded.
         try:
-            image = Image.open(BytesIO(img_data)).convert('RGB')
-            ph = imagehash.phash(image)
-            self.phash = ph.__str__()  # returns hex string
+            image = Image.open(BytesIO(img_data))
+            image.draft('RGB', (256, 256))
+            image = image.convert('RGB')
+            self.phash = format(fast_phash(image), '016x')  # hex string for the database
         except Exception as e:
             print(f"Failed to compute pHash for {self.image_url}: {e}")
             self.phash = None
-        # NSFW detection
-        if nsfw_model:
-            try:
-                # nsfw_detector expects a dict mapping filepaths to arrays; we
-                # can use the in-memory image by converting to numpy.
-                # Save to a temporary in‑memory file via BytesIO.
-                temp = BytesIO(img_data)
-                temp.name = 'image.jpg'
-                nsfw_preds: Dict[str, Dict[str, float]] = predict.classify(nsfw_model, temp)  # type: ignore
-                scores = list(nsfw_preds.values())[0]
-                # Use the maximum of porn categories as the NSFW probability
-                self.nsfw_score = float(
-                    scores.get('porn', 0) + scores.get('hentai', 0) + scores.get('sexy', 0)
-                )
-            except Exception as e:
-                print(f"Failed to run NSFW detector on {self.image_url}: {e}")
-                self.nsfw_score = 0.0
-        else:
-            # If NSFW model not available treat everything as safe
-            self.nsfw_score = 0.0
-        # Filter out obviously NSFW
-        return self.nsfw_score < 0.4
+            return None
+        if not nsfw:
+            return None
+        # Same preprocessing as nsfw_detector: 224x224 RGB scaled to [0, 1]
+        resized = image.resize((NSFW_IMAGE_DIM, NSFW_IMAGE_DIM), Image.NEAREST)
+        return np.asarray(resized, dtype=np.float32) / 255.0
+
+
+def fast_phash(image: Image.Image) -> int:
+    """
+    Computes the perceptual hash of an image as a 64-bit integer.  Produces
+    the same bits as imagehash.phash, but in FP32 and without computing the
+    high frequency coefficients that are discarded anyway.
+    """
+    pixels = np.asarray(image.convert('L').resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float32)
+    low = _DCT_LOW @ pixels @ _DCT_LOW.T
+    bits = np.packbits(low > np.median(low))
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def classify_nsfw(nsfw_model, images: List[np.ndarray]) -> List[float]:
+    """
+    Runs the NSFW model over all images in batched forward passes and
+    returns one NSFW probability per image.  This calls the model (Keras or
+    TFLite) directly rather than predict.classify, which handles one file at
+    a time and pays the per-call graph overhead for every image.
+    """
+    if not images:
+        return []
+    batch = np.stack(images)
+    preds = nsfw_model.predict(batch, batch_size=NSFW_BATCH_SIZE, verbose=0)
+    return [float(p) for p in np.asarray(preds)[:, NSFW_EXPLICIT].sum(axis=1)]
+
+
+class KerasNSFWModel:
+    """
+    Wraps the Keras NSFW model in a tf.function with a fixed input signature,
+    so it is traced once and each batch skips Keras' predict() machinery.
+    """
+
+    def __init__(self, model) -> None:
+        self.model = model
+        self.infer = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec([None, NSFW_IMAGE_DIM, NSFW_IMAGE_DIM, 3], tf.float32)],
+        )
+
+    def predict(self, images: np.ndarray, batch_size: int = NSFW_BATCH_SIZE, verbose: int = 0) -> np.ndarray:
+        return np.concatenate([
+            self.infer(images[start:start + batch_size]).numpy()
+            for start in range(0, len(images), batch_size)
+        ])
+
+
+class TFLiteNSFWModel:
+    """
+    Wraps a TFLite interpreter behind the same predict() API as
+    KerasNSFWModel, so either can be passed around as NSFW_MODEL.
+    """
+
+    def __init__(self, model_path: str) -> None:
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=NSFW_THREADS)
+        # Look up the tensor indices and size the input for a full batch once;
+        # every invoke then reuses the same allocation.
+        self.in_idx = self.interpreter.get_input_details()[0]['index']
+        self.out_idx = self.interpreter.get_output_details()[0]['index']
+        self.batch_buf = np.zeros((NSFW_BATCH_SIZE, NSFW_IMAGE_DIM, NSFW_IMAGE_DIM, 3), dtype=np.float32)
+        self.interpreter.resize_tensor_input(self.in_idx, self.batch_buf.shape)
+        self.interpreter.allocate_tensors()
+
+    def predict(self, images: np.ndarray, batch_size: int = NSFW_BATCH_SIZE, verbose: int = 0) -> np.ndarray:
+        # batch_size is fixed by the allocated input tensor; the argument is
+        # accepted for API compatibility only.
+        outputs = []
+        for start in range(0, len(images), NSFW_BATCH_SIZE):
+            batch = images[start:start + NSFW_BATCH_SIZE]
+            # A short final batch is padded with stale rows whose outputs
+            # are discarded, rather than reallocating the input tensor.
+            self.batch_buf[:len(batch)] = batch
+            self.interpreter.set_tensor(self.in_idx, self.batch_buf)
+            self.interpreter.invoke()
+            outputs.append(self.interpreter.get_tensor(self.out_idx)[:len(batch)].copy())
+        return np.concatenate(outputs)
+
+
+def load_nsfw_model():
+    """
+    Loads the NSFW model, preferring the quantized TFLite file produced by
+    convert_nsfw_model.py.  Falls back to the Keras model at NSFW_MODEL_PATH
+    if one is configured.  Returns None if no model can be loaded, in which
+    case every image is treated as safe.
+    """
+    if tf is None:
+        return None
+    if os.path.exists(NSFW_TFLITE_PATH):
+        try:
+            return TFLiteNSFWModel(NSFW_TFLITE_PATH)
+        except Exception as e:
+            print(f"Failed to load TFLite NSFW model: {e}")
+    if not predict or not NSFW_MODEL_PATH:
+        return None
+    try:
+        return KerasNSFWModel(predict.load_model(NSFW_MODEL_PATH))
+    except Exception as e:
+        print(f"Failed to load NSFW model: {e}")
+        return None
+
+
+def preview_image_url(post: Dict) -> Optional[str]:
+    """
+    Returns the URL of the smallest Reddit preview that is still large enough
+    for hashing and NSFW detection, or None if the post has no preview.  The
+    pHash is insensitive to scale, and previews are a fraction of the size
+    of the original upload.
+    """
+    try:
+        resolutions = post['preview']['images'][0]['resolutions']
+    except (KeyError, IndexError, TypeError):
+        return None
+    for res in resolutions:
+        if res.get('width', 0) >= PREVIEW_MIN_DIM and res.get('height', 0) >= PREVIEW_MIN_DIM:
+            # Reddit HTML-escapes the query string (&amp;)
+            return html.unescape(res['url'])
+    return None
 
 
 def fetch_reddit_posts(subreddit: str, user_agent: str, limit: int = 20) -> List[MemeCandidate]:
@@ -136,7 +340,7 @@ def fetch_reddit_posts(subreddit: str, user_agent: str, limit: int = 20) -> List
     """
     url = f"https://www.reddit.com/r/{subreddit}/top.json?t=day&limit={limit}"
     try:
-        resp = requests.get(url, headers={"User-Agent": user_agent}, timeout=15)
+        resp = SESSION.get(url, headers={"User-Agent": user_agent}, timeout=15)
         resp.raise_for_status()
         data = resp.json()
     except Exception as e:
@@ -172,84 +376,203 @@ def fetch_reddit_posts(subreddit: str, user_agent: str, limit: int = 20) -> List
             source_url=source_url,
             author=author,
             score=score,
+            preview_url=preview_image_url(post),
         )
         candidates.append(candidate)
     return candidates
 
 
-def load_existing_hashes(supabase: 'Client') -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+def load_existing_hashes(supabase: 'Client') -> Tuple[np.ndarray, List[str]]:
     """
-    Fetches all existing MD5 and pHash values from the database.  Returns a
-    mapping of MD5 → meme ID for exact match detection and a list of
-    (pHash, id) tuples for near duplicate detection.  Entries with null
-    pHash are excluded from the list.
+    Fetches all existing pHash values from the database for client-side near
+    duplicate detection.  Returns a contiguous uint64 array of pHashes and a
+    parallel list of meme IDs, so all hashes can be compared in one call.
+    Entries with null or malformed pHash are excluded.  Exact (MD5)
+    duplicates are handled by the database on insert, so MD5s are not
+    fetched.
     """
-    existing_md5: Dict[str, str] = {}
-    existing_phash: List[Tuple[str, str]] = []
     try:
-        response = supabase.table('memes').select('id, md5, phash').execute()
-        for row in response.data:
-            md5 = row.get('md5')
-            if md5:
-                existing_md5[md5] = row['id']
-            ph = row.get('phash')
-            if ph:
-                existing_phash.append((ph, row['id']))
+        response = supabase.table('memes').select('id, phash').not_.is_('phash', 'null').execute()
     except Exception as e:
         error(f"Failed to fetch existing hashes: {e}")
-    return existing_md5, existing_phash
+    existing_phash = np.empty(len(response.data), dtype=np.uint64)
+    existing_ids: List[str] = []
+    for row in response.data:
+        try:
+            existing_phash[len(existing_ids)] = int(row['phash'], 16)
+        except (ValueError, OverflowError):
+            continue
+        existing_ids.append(row['id'])
+    return existing_phash[:len(existing_ids)], existing_ids
+
+
+def load_hash_cache(supabase: 'Client', column: str, values: List[str]) -> Tuple[Dict[str, Tuple[Optional[str], Optional[float]]], Dict[str, str]]:
+    """
+    Fetches previously computed hashes from the meme_hash_cache table for
+    the rows whose column ('image_url' or 'md5') is one of values.  Returns
+    a mapping of MD5 → (pHash, NSFW score) and a mapping of image URL → MD5,
+    so repeat images skip decoding and NSFW inference and repeat URLs skip
+    the download entirely.  Only the batch's keys are queried, so the cost
+    does not grow with the table.  A missing cache table is not fatal.
+    """
+    by_md5: Dict[str, Tuple[Optional[str], Optional[float]]] = {}
+    by_url: Dict[str, str] = {}
+    values = list(set(values))
+    try:
+        # Query in chunks to keep the filter within URL length limits
+        for start in range(0, len(values), HASH_CACHE_QUERY_CHUNK):
+            chunk = values[start:start + HASH_CACHE_QUERY_CHUNK]
+            response = supabase.table('meme_hash_cache').select('image_url, md5, phash, nsfw_score').in_(column, chunk).execute()
+            for row in response.data:
+                nsfw_score = row.get('nsfw_score')
+                by_md5[row['md5']] = (row.get('phash'), None if nsfw_score is None else float(nsfw_score))
+                by_url[row['image_url']] = row['md5']
+    except Exception as e:
+        print(f"Failed to fetch hash cache: {e}")
+    return by_md5, by_url
+
+
+def save_hash_cache(supabase: 'Client', candidates: List[MemeCandidate], scored: bool) -> None:
+    """
+    Upserts the hashes of the given candidates into the meme_hash_cache
+    table.  NSFW scores are only stored if they came from the model.
+    """
+    if not candidates:
+        return
+    # Postgres rejects an upsert that touches the same row twice, so keep
+    # one row per image URL.
+    rows = list({cand.image_url: {
+        'image_url': cand.image_url,
+        'md5': cand.md5,
+        'phash': cand.phash,
+        'nsfw_score': cand.nsfw_score if scored else None,
+    } for cand in candidates}.values())
+    try:
+        supabase.table('meme_hash_cache').upsert(rows, on_conflict='image_url').execute()
+    except Exception as e:
+        print(f"Failed to update hash cache: {e}")
 
 
-def find_duplicate(candidate: MemeCandidate, existing_md5: Dict[str, str], existing_phash: List[Tuple[str, str]]) -> Optional[str]:
+def hamming_batch(cand: int, phashes: np.ndarray) -> np.ndarray:
+    """Returns the Hamming distance between cand and every hash in phashes."""
+    xor = phashes ^ np.uint64(cand)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    words = xor.view(np.uint16).reshape(-1, 4)
+    return _POPCOUNT_16[words].sum(axis=1, dtype=np.uint8)
+
+
+def find_duplicate(candidate: MemeCandidate, existing_phash: np.ndarray, existing_ids: List[str]) -> Optional[str]:
     """
-    Checks if the candidate duplicates an existing meme.  Returns the ID of the
-    meme it duplicates or None if unique.  Exact duplicates (matching MD5)
-    supersede near duplicates.  Near duplicates are detected when the
-    Hamming distance between pHashes is less than 5.
+    Checks if the candidate near-duplicates an existing meme.  Returns the ID
+    of the meme it duplicates or None if unique.  Near duplicates are
+    detected when the Hamming distance between pHashes is less than 5; the
+    closest match is returned.
     """
-    if candidate.md5 in existing_md5:
-        return existing_md5[candidate.md5]
-    if candidate.phash:
+    if candidate.phash and len(existing_phash):
         try:
-            cand_hash = imagehash.hex_to_hash(candidate.phash)
-            for ph, mid in existing_phash:
-                try:
-                    h = imagehash.hex_to_hash(ph)
-                    # The subtraction operator on ImageHash returns the Hamming distance
-                    dist = cand_hash - h
-                    if dist < 5:
-                        return mid
-                except Exception:
-                    continue
-        except Exception:
-            pass
+            cand_hash = int(candidate.phash, 16)
+        except ValueError:
+            return None
+        dists = hamming_batch(cand_hash, existing_phash)
+        idx = int(np.argmin(dists))
+        if dists[idx] < 5:
+            return existing_ids[idx]
     return None
 
 
-def insert_pending(supabase: 'Client', candidates: List[MemeCandidate]) -> None:
+def split_batch_duplicates(candidates: List[MemeCandidate]) -> Tuple[List[MemeCandidate], List[Tuple[MemeCandidate, MemeCandidate]]]:
     """
-    Inserts a batch of new pending memes into the database.  Skips those that
-    duplicate existing memes or are NSFW.
+    Separates candidates that near-duplicate an earlier candidate in the same
+    batch (pHash Hamming distance less than 5) from the rest.  Returns the
+    first copies and a list of (copy, first copy) pairs.  Exact duplicates
+    have already been removed by MD5.  Candidates without a pHash are always
+    kept.
     """
-    existing_md5, existing_phash = load_existing_hashes(supabase)
-    to_insert = []
+    kept: List[MemeCandidate] = []
+    copies: List[Tuple[MemeCandidate, MemeCandidate]] = []
+    # pHashes of the kept candidates that have one, and those candidates
+    seen_phash = np.empty(len(candidates), dtype=np.uint64)
+    seen: List[MemeCandidate] = []
     for cand in candidates:
-        # Download image, compute MD5, pHash and NSFW score (we compute the NSFW score but do not filter out NSFW content)
-        # Calling download_and_process will set md5, phash and nsfw_score on the candidate.
-        cand.download_and_process(NSFW_MODEL)
-        dup_id = find_duplicate(cand, existing_md5, existing_phash)
-        cand.duplicate_of = dup_id
-        # Only insert if not exact duplicate; near duplicates are allowed but flagged
-        if dup_id and cand.md5 in existing_md5:
-            # Skip exact duplicates entirely
-            continue
-        to_insert.append(cand)
-    if not to_insert:
-        print("No new memes to insert.")
-        return
+        if cand.phash:
+            cand_hash = int(cand.phash, 16)
+            if seen:
+                dists = hamming_batch(cand_hash, seen_phash[:len(seen)])
+                idx = int(np.argmin(dists))
+                if dists[idx] < 5:
+                    copies.append((cand, seen[idx]))
+                    continue
+            seen_phash[len(seen)] = cand_hash
+            seen.append(cand)
+        kept.append(cand)
+    return kept, copies
+
+
+def find_existing_md5(supabase: 'Client', md5s: List[str]) -> Dict[str, str]:
+    """
+    Looks up which of the given MD5s already exist in the database.  Returns
+    a mapping of MD5 → meme ID for the ones that do.  Only the batch's MD5s
+    are queried, so the cost does not grow with the table.
+    """
+    existing_md5: Dict[str, str] = {}
+    if not md5s:
+        return existing_md5
+    try:
+        response = supabase.table('memes').select('id, md5').in_('md5', list(set(md5s))).execute()
+        for row in response.data:
+            existing_md5[row['md5']] = row['id']
+    except Exception as e:
+        # Exact duplicates are still caught by the duplicate search later
+        print(f"Failed to look up existing MD5s: {e}")
+    return existing_md5
+
+
+def find_duplicates_local(supabase: 'Client', candidates: List[MemeCandidate]) -> Dict[str, Tuple[str, bool]]:
+    """
+    Finds near duplicates by pulling every existing pHash and comparing on
+    the client.  Returns a mapping of candidate MD5 → (duplicate meme ID,
+    exact match) for candidates that duplicate an existing meme; exact is
+    always False here since MD5 conflicts are resolved by the upsert.
+    """
+    existing_phash, existing_ids = load_existing_hashes(supabase)
+    duplicates: Dict[str, Tuple[str, bool]] = {}
+    for cand in candidates:
+        dup_id = find_duplicate(cand, existing_phash, existing_ids)
+        if dup_id:
+            duplicates[cand.md5] = (dup_id, False)
+    return duplicates
+
+
+def find_duplicates_remote(supabase: 'Client', candidates: List[MemeCandidate]) -> Optional[Dict[str, Tuple[str, bool]]]:
+    """
+    Finds duplicates with the find_dups Postgres function (see README.md),
+    which matches MD5s and pHash Hamming distances inside the database so
+    only the matches are transferred.  pHashes are sent as hex; the
+    database compares them against its precomputed bit(64) phash_bits
+    column and, like find_duplicate, picks the closest near duplicate.
+    Returns the same mapping as find_duplicates_local, or None if the
+    function is unavailable.
+    """
+    if not candidates:
+        return {}
+    cands = [{'md5': cand.md5, 'phash': cand.phash} for cand in candidates]
+    try:
+        response = supabase.rpc('find_dups', {'cands': cands}).execute()
+    except Exception as e:
+        print(f"Server-side duplicate search unavailable, falling back to client-side: {e}")
+        return None
+    return {row['cand_md5']: (row['dup_id'], bool(row['exact'])) for row in response.data}
+
+
+def insert_memes(supabase: 'Client', candidates: List[MemeCandidate]) -> List[Dict]:
+    """
+    Inserts the candidates into the memes table and returns the inserted
+    rows.  Exits with an error if the insert fails.
+    """
     # Prepare rows for insertion
     rows = []
-    for cand in to_insert:
+    for cand in candidates:
         # Build the row dictionary. We include a published_at timestamp to
         # ensure the frontend displays the meme immediately. The status is set
         # to 'approved' so no manual moderation is required.
@@ -267,10 +590,159 @@ def insert_pending(supabase: 'Client', candidates: List[MemeCandidate]) -> None:
             'published_at': datetime.datetime.utcnow().isoformat()
         })
     try:
-        res = supabase.table('memes').insert(rows).execute()
-        print(f"Inserted {len(res.data)} new memes.")
+        # MD5 is unique, so exact duplicates that slipped past the checks
+        # above (e.g. inserted concurrently) are dropped by the database.
+        return supabase.table('memes').upsert(rows, on_conflict='md5', ignore_duplicates=True).execute().data
+    except Exception as e:
+        # 42P10: no unique index on md5 yet (see README.md); insert plainly
+        # and rely on the duplicate checks above.
+        if getattr(e, 'code', None) != '42P10' and 'no unique or exclusion constraint' not in str(e):
+            error(f"Failed to insert memes: {e}")
+        print(f"memes.md5 has no unique index, falling back to a plain insert: {e}")
+    try:
+        return supabase.table('memes').insert(rows).execute().data
     except Exception as e:
         error(f"Failed to insert memes: {e}")
+    return []
+
+
+def insert_pending(supabase: 'Client', candidates: List[MemeCandidate]) -> None:
+    """
+    Inserts a batch of new pending memes into the database.  Skips those that
+    duplicate existing memes or are NSFW.
+    """
+    cache_by_md5, cache_by_url = load_hash_cache(supabase, 'image_url', [cand.image_url for cand in candidates])
+    scored = NSFW_MODEL is not None
+
+    def cached(md5: Optional[str]) -> bool:
+        # A cache entry is usable if it has a score or there is no model to
+        # compute one anyway.
+        return md5 in cache_by_md5 and (cache_by_md5[md5][1] is not None or not scored)
+
+    # Work out every candidate's MD5 as cheaply as possible: from the URL
+    # cache if we have seen the URL before, otherwise by downloading it.
+    hashed: List[Tuple[MemeCandidate, Optional[bytes]]] = []
+    to_download: List[MemeCandidate] = []
+    # Crossposts often share the image URL; download each URL only once
+    queued: Set[str] = set()
+    repeat_urls: List[MemeCandidate] = []
+    for cand in candidates:
+        md5 = cache_by_url.get(cand.image_url)
+        if cached(md5):
+            # Seen this URL before; no need to download it again
+            cand.md5 = md5
+            hashed.append((cand, None))
+        elif cand.image_url in queued:
+            repeat_urls.append(cand)
+        else:
+            queued.add(cand.image_url)
+            to_download.append(cand)
+    # Download (and MD5) all images concurrently over the shared session;
+    # the CPU bound processing below runs once the bytes are in memory.
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        downloads = list(executor.map(lambda c: c.download(SESSION), to_download))
+    downloaded_md5: Dict[str, str] = {}
+    for cand, img_data in zip(to_download, downloads):
+        if img_data is None:
+            # Download failed; nothing to process or insert
+            continue
+        hashed.append((cand, img_data))
+        downloaded_md5[cand.image_url] = cand.md5
+    for cand in repeat_urls:
+        if cand.image_url in downloaded_md5:
+            # Same bytes as the first download; handled as an exact copy
+            # below without caching the URL a second time.
+            cand.md5 = downloaded_md5[cand.image_url]
+            hashed.append((cand, None))
+    # A new URL may still carry an image we have hashed before
+    new_md5 = [cand.md5 for cand, img_data in hashed if img_data is not None and cand.md5 not in cache_by_md5]
+    cache_by_md5.update(load_hash_cache(supabase, 'md5', new_md5)[0])
+    # Exact duplicates are the common case on repeat runs; drop them before
+    # paying for decoding, pHash and NSFW inference.
+    existing_md5 = find_existing_md5(supabase, [cand.md5 for cand, _ in hashed])
+    processed: List[MemeCandidate] = []
+    fresh: List[MemeCandidate] = []
+    to_process: List[Tuple[MemeCandidate, bytes]] = []
+    # Exact copies of an earlier candidate, the candidate they copy, and
+    # whether the copy was downloaded (i.e. its URL is not cached yet)
+    exact_copies: List[Tuple[MemeCandidate, MemeCandidate, bool]] = []
+    seen_md5: Dict[str, MemeCandidate] = {}
+    for cand, img_data in hashed:
+        if cand.md5 in existing_md5:
+            # Exact duplicate of an existing meme
+            continue
+        if cand.md5 in seen_md5:
+            exact_copies.append((cand, seen_md5[cand.md5], img_data is not None))
+            continue
+        seen_md5[cand.md5] = cand
+        if cached(cand.md5):
+            # Known image; reuse the stored hashes
+            cand.apply_cached(cand.md5, cache_by_md5[cand.md5])
+        else:
+            to_process.append((cand, img_data))
+        processed.append(cand)
+        if img_data is not None:
+            fresh.append(cand)
+    # Decode and pHash on all cores; Pillow and NumPy release the GIL for
+    # the heavy lifting.  Calling process will set phash on the candidate.
+    with ThreadPoolExecutor(max_workers=PROCESS_WORKERS) as executor:
+        results = list(executor.map(lambda item: item[0].process(item[1], nsfw=scored), to_process))
+    # Two subreddits often carry the same meme; only the first copy goes
+    # through NSFW inference and the duplicate search, and the others
+    # inherit its results.
+    processed, near_copies = split_batch_duplicates(processed)
+    kept = set(map(id, processed))
+    nsfw_inputs: List[Tuple[MemeCandidate, np.ndarray]] = [
+        (cand, nsfw_input) for (cand, _), nsfw_input in zip(to_process, results)
+        if nsfw_input is not None and id(cand) in kept
+    ]
+    # Compute NSFW scores in one batch (we compute the NSFW score but do not filter out NSFW content)
+    if NSFW_MODEL and nsfw_inputs:
+        try:
+            scores = classify_nsfw(NSFW_MODEL, [img for _, img in nsfw_inputs])
+            for (cand, _), nsfw_score in zip(nsfw_inputs, scores):
+                cand.nsfw_score = nsfw_score
+        except Exception as e:
+            print(f"Failed to run NSFW detector: {e}")
+            scored = False
+    for copy, first in near_copies:
+        copy.nsfw_score = first.nsfw_score
+    for copy, first, downloaded in exact_copies:
+        copy.phash, copy.nsfw_score = first.phash, first.nsfw_score
+        if downloaded:
+            # Cache the URL so the next run skips downloading it again
+            fresh.append(copy)
+    # Near copies only borrowed their score, so cache them without one and
+    # let the model score them if their entry is reused.
+    near = set(id(copy) for copy, _ in near_copies)
+    save_hash_cache(supabase, [cand for cand in fresh if id(cand) not in near], scored)
+    save_hash_cache(supabase, [cand for cand in fresh if id(cand) in near], False)
+    # Prefer the server-side duplicate search; fall back to pulling every
+    # hash if the find_dups function has not been installed.
+    duplicates = find_duplicates_remote(supabase, processed)
+    if duplicates is None:
+        duplicates = find_duplicates_local(supabase, processed)
+    to_insert = []
+    for cand in processed:
+        dup_id, exact = duplicates.get(cand.md5, (None, False))
+        cand.duplicate_of = dup_id
+        # Only insert if not exact duplicate; near duplicates are allowed but flagged
+        if exact:
+            # Skip exact duplicates entirely
+            continue
+        to_insert.append(cand)
+    if not to_insert and not near_copies:
+        print("No new memes to insert.")
+        return
+    inserted = insert_memes(supabase, to_insert) if to_insert else []
+    if near_copies:
+        # Near duplicates within the batch point at the row just inserted
+        # for their first copy (or at whatever that copy duplicates).
+        inserted_ids = {row['md5']: row['id'] for row in inserted}
+        for copy, first in near_copies:
+            copy.duplicate_of = inserted_ids.get(first.md5, first.duplicate_of)
+        inserted += insert_memes(supabase, [copy for copy, _ in near_copies])
+    print(f"Inserted {len(inserted)} new memes.")
 
 
 def main() -> None:
@@ -285,13 +757,7 @@ def main() -> None:
     # Create Supabase client
     supabase: Client = create_client(supabase_url, supabase_key)
     # Load NSFW model if available
-    NSFW_MODEL = None
-    if predict:
-        try:
-            NSFW_MODEL = predict.load_model()
-        except Exception as e:
-            print(f"Failed to load NSFW model: {e}")
-            NSFW_MODEL = None
+    NSFW_MODEL = load_nsfw_model()
     # Define target subreddits
     subreddits = [
         'memes',
@@ -300,10 +766,12 @@ def main() -> None:
         'wholesomememes',
         'AdviceAnimals'
     ]
+    print(f"Fetching top posts from {', '.join('r/' + sub for sub in subreddits)}…")
+    # Fetch all subreddits concurrently; each request is a network round trip
+    with ThreadPoolExecutor(max_workers=len(subreddits)) as executor:
+        results = list(executor.map(lambda sub: fetch_reddit_posts(sub, reddit_user_agent, limit=25), subreddits))
     all_candidates: List[MemeCandidate] = []
-    for sub in subreddits:
-        print(f"Fetching top posts from r/{sub}…")
-        posts = fetch_reddit_posts(sub, reddit_user_agent, limit=25)
+    for sub, posts in zip(subreddits, results):
         print(f"  Retrieved {len(posts)} candidates from r/{sub}.")
         all_candidates.extend(posts)
     if not all_candidates: